@@ -8,9 +8,10 @@ from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from langgraph.graph import StateGraph, END
 from app.llm_client import llm
 from app.vector_indexer import vector_indexer
-from app.shared_resources import redis_client
+from app.session_state import session_cache
+from app.resilience import openrouter_breaker
+from app.profiling import profiled, profile_request
 import uuid
-import json
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -43,34 +44,13 @@ def log_step(state: AgentState, step: str) -> AgentState:
     return state
 
 def get_conversation_history(thread_id: str) -> List[Dict[str, str]]:
-    """Get conversation history for a thread from Redis"""
-    try:
-        history = redis_client.get(f"conversation:{thread_id}")
-        return json.loads(history) if history else []
-    except Exception as e:
-        logger.error(f"Error getting conversation history: {e}")
-        return []
+    """Get conversation history for a thread from the session cache"""
+    return session_cache.get_messages(thread_id)
 
-def update_conversation_history(thread_id: str, role: str, content: str):
-    """Update conversation history in Redis"""
-    try:
-        history = get_conversation_history(thread_id)
-        
-        # Add new message
-        history.append({
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        # Keep only the last 20 messages
-        history = history[-20:]
-        
-        # Save back to Redis
-        redis_client.set(f"conversation:{thread_id}", json.dumps(history))
-        
-    except Exception as e:
-        logger.error(f"Error updating conversation history: {e}")
+def update_conversation_history(thread_id: str, role: str, content: str, thinking_steps: List[str] = None,
+                                conversation_id: str = None):
+    """Update conversation history; Supabase persistence happens write-behind"""
+    session_cache.append_message(thread_id, role, content, thinking_steps, conversation_id)
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -78,6 +58,7 @@ logger = logging.getLogger(__name__)
 
 
 
+@profiled("retrieve")
 def retrieve_context(state: AgentState) -> AgentState:
     """Retrieve relevant context using RAG"""
     state = log_step(state, "🔍 Searching knowledge base...")
@@ -88,6 +69,11 @@ def retrieve_context(state: AgentState) -> AgentState:
             
         last_message = state["messages"][-1]["content"]
         
+        # Don't wait on a knowledge base that is known to be down
+        if not vector_indexer.is_available("default"):
+            state = log_step(state, "⚠️ Knowledge base unavailable, using general knowledge")
+            return {**state, "context": "Knowledge base unavailable. Using general knowledge."}
+        
         # Get relevant chunks from Redis vector store
         chunks = vector_indexer.search_similar_chunks(
             query=last_message,
@@ -110,7 +96,8 @@ def retrieve_context(state: AgentState) -> AgentState:
         state = log_step(state, f"❌ {error_msg}")
         return {**state, "context": "Error retrieving context. Using general knowledge."}
 
-def generate_response(state: AgentState) -> AgentState:
+@profiled("generate")
+async def generate_response(state: AgentState) -> AgentState:
     """Generate response using LLM with context and history"""
     state = log_step(state, "🧠 Generating response...")
     
@@ -133,8 +120,8 @@ def generate_response(state: AgentState) -> AgentState:
             HumanMessage(content=last_message["content"])
         ]
         
-        # Generate response
-        response = llm.invoke(messages)
+        # Generate response; awaiting lets a cancelled turn abort the upstream request
+        response = await openrouter_breaker.acall(llm.ainvoke, messages)
         state = log_step(state, "✅ Response generated")
         
         # Add assistant's response to messages
@@ -193,7 +180,8 @@ check_vector_store()
 # Global agent instance
 agent = create_agent_workflow()
 
-async def process_message(thread_id: str, content: str, quote: str = None) -> tuple[str, list]:
+async def process_message(thread_id: str, content: str, quote: str = None, profile: bool = False,
+                          conversation_id: str = None) -> tuple[str, list]:
     """
     Process a message through the agent with RAG and conversation history
     
@@ -201,6 +189,8 @@ async def process_message(thread_id: str, content: str, quote: str = None) -> tu
         thread_id: The conversation thread ID
         content: The message content
         quote: Optional quoted text from the conversation
+        profile: Request profiling of this turn (only honoured when profiling is enabled)
+        conversation_id: Supabase conversation to persist messages to, if any
         
     Returns:
         A tuple of (response_text, thinking_steps)
@@ -225,16 +215,17 @@ async def process_message(thread_id: str, content: str, quote: str = None) -> tu
             "thread_id": thread_id
         }
         
-        # Run the agent
-        result = agent.invoke(state)
+        # Run the agent (cancelling the caller's task aborts the LLM call)
+        async with profile_request(profile):
+            result = await agent.ainvoke(state)
         
         # Get the assistant's response and thinking steps
         assistant_response = result["messages"][-1]["content"]
         thinking_steps = result.get("thinking_steps", [])
         
         # Update conversation history
-        update_conversation_history(thread_id, "user", content)
-        update_conversation_history(thread_id, "assistant", assistant_response)
+        update_conversation_history(thread_id, "user", content, conversation_id=conversation_id)
+        update_conversation_history(thread_id, "assistant", assistant_response, thinking_steps, conversation_id)
         
         return assistant_response, thinking_steps
         
@@ -277,7 +268,8 @@ Relevant context:
 User's question: {question}"""
 
 # Then update the generate_response function to handle different types of queries
-def generate_response(state: AgentState) -> AgentState:
+@profiled("generate")
+async def generate_response(state: AgentState) -> AgentState:
     """Generate response using LLM with context and history"""
     state = log_step(state, "🧠 Generating response...")
     
@@ -315,8 +307,8 @@ def generate_response(state: AgentState) -> AgentState:
             ]
             state = log_step(state, "ℹ️ Using context for response")
         
-        # Generate response
-        response = llm.invoke(messages)
+        # Generate response; awaiting lets a cancelled turn abort the upstream request
+        response = await openrouter_breaker.acall(llm.ainvoke, messages)
         state = log_step(state, "✅ Response generated")
         
         # Add assistant's response to messages
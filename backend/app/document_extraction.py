@@ -0,0 +1,119 @@
+"""
+Document text extraction for the Binod AI Assistant backend.
+
+Loaders are CPU-bound, so they run in a shared process pool instead of on the
+event loop. Large PDFs are split into page ranges that are parsed in parallel
+and streamed back to the caller in page order.
+"""
+
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+PDF_CONTENT_TYPE = "application/pdf"
+TEXT_CONTENT_TYPES = ["text/plain", "text/markdown"]
+DOCX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+SUPPORTED_CONTENT_TYPES = [PDF_CONTENT_TYPE, *TEXT_CONTENT_TYPES, DOCX_CONTENT_TYPE]
+
+# Pages parsed by a single worker task
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 16))
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """Return the shared extraction process pool, creating it on first use"""
+    global _executor
+    if _executor is None:
+        max_workers = int(os.getenv("EXTRACTION_WORKERS", os.cpu_count() or 1))
+        # Spawn rather than fork: the parent already holds torch/tokenizer threads and model memory
+        _executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info(f"Started extraction pool with {max_workers} workers")
+    return _executor
+
+
+def shutdown_extraction_pool():
+    """Shut down the extraction pool, waiting for running tasks"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+        logger.info("Extraction pool shut down")
+
+
+# Worker functions: run in child processes and return plain, picklable data
+
+def _count_pdf_pages(path: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(path).pages)
+
+
+def _load_pdf_pages(path: str, start: int, end: int) -> List[Dict]:
+    """Extract pages [start, end) the same way PyPDFLoader does"""
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    return [
+        {
+            "page_content": reader.pages[page].extract_text(),
+            "metadata": {"source": path, "page": page}
+        }
+        for page in range(start, end)
+    ]
+
+
+def _load_with_loader(path: str, content_type: str) -> List[Dict]:
+    """Extract a non-PDF file with its langchain loader"""
+    from langchain_community.document_loaders import TextLoader, Docx2txtLoader
+    if content_type in TEXT_CONTENT_TYPES:
+        loader = TextLoader(path, encoding="utf-8")
+    else:
+        loader = Docx2txtLoader(path)
+    return [
+        {"page_content": doc.page_content, "metadata": doc.metadata}
+        for doc in loader.load()
+    ]
+
+
+async def extract_documents(path: str, content_type: str) -> AsyncIterator[List[Document]]:
+    """
+    Extract a file in the process pool, yielding batches of Documents in order.
+
+    PDFs yield one batch per page range as soon as that range (and every range
+    before it) has been parsed; other formats yield a single batch.
+    """
+    if content_type not in SUPPORTED_CONTENT_TYPES:
+        raise ValueError(f"Unsupported content type: {content_type}")
+
+    loop = asyncio.get_running_loop()
+    pool = get_extraction_pool()
+
+    if content_type == PDF_CONTENT_TYPE:
+        num_pages = await loop.run_in_executor(pool, _count_pdf_pages, path)
+        ranges = [
+            (start, min(start + PDF_PAGES_PER_TASK, num_pages))
+            for start in range(0, num_pages, PDF_PAGES_PER_TASK)
+        ]
+        logger.info(f"Extracting {num_pages} PDF pages from {path} in {len(ranges)} tasks")
+        futures = [
+            loop.run_in_executor(pool, _load_pdf_pages, path, start, end)
+            for start, end in ranges
+        ]
+        try:
+            for future in futures:
+                pages = await future
+                yield [Document(**page) for page in pages]
+        finally:
+            for future in futures:
+                future.cancel()
+    else:
+        docs = await loop.run_in_executor(pool, _load_with_loader, path, content_type)
+        yield [Document(**doc) for doc in docs]
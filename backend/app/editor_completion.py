@@ -0,0 +1,165 @@
+"""
+Editor autocomplete over WebSocket.
+
+Keystrokes for a session are debounced and any in-flight completion is
+cancelled when newer context arrives. Completions are cached in Redis keyed by
+a hash of the context window, so repeated prefixes are answered without an
+LLM call.
+"""
+from fastapi import WebSocket, WebSocketDisconnect
+from langchain_core.messages import HumanMessage, SystemMessage
+from app.llm_client import ChatOpenRouter
+from app.vector_indexer import vector_indexer
+from app.shared_resources import redis_client
+from app.resilience import redis_breaker, openrouter_breaker
+
+import os
+import json
+import uuid
+import asyncio
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Wait this long after the last keystroke before requesting a completion
+DEBOUNCE_SECONDS = float(os.getenv("EDITOR_DEBOUNCE_MS", 150)) / 1000
+# Characters of text before/after the cursor sent to the model
+PREFIX_WINDOW = int(os.getenv("EDITOR_PREFIX_WINDOW", 1500))
+SUFFIX_WINDOW = int(os.getenv("EDITOR_SUFFIX_WINDOW", 300))
+# Short generations keep suggestion latency interactive
+MAX_TOKENS = int(os.getenv("EDITOR_MAX_TOKENS", 48))
+CACHE_TTL_SECONDS = int(os.getenv("EDITOR_CACHE_TTL", 3600))
+
+EDITOR_PROMPT = """You are an inline autocomplete engine for a text and code editor.
+Continue the text at the cursor. Reply with only the text to insert, without
+repeating the prefix and without explanations. Keep it short.
+
+Relevant context:
+{context}"""
+
+
+def context_window(prefix: str, suffix: str) -> tuple[str, str]:
+    """Trim the text around the cursor to the configured window"""
+    return prefix[-PREFIX_WINDOW:], suffix[:SUFFIX_WINDOW]
+
+
+def cache_key(prefix: str, suffix: str, project_id: str) -> str:
+    """Redis key for a completion, keyed by the hash of the context window"""
+    digest = hashlib.sha256(f"{project_id}\0{prefix}\0{suffix}".encode("utf-8")).hexdigest()
+    return f"editor:completion:{digest}"
+
+
+class EditorManager:
+    def __init__(self):
+        logger.info("EditorManager initialized")
+        # No semantic cache: an embedding + vector lookup per keystroke costs more
+        # than it saves, and a near match may belong to another cursor context.
+        # The exact context-window cache below covers repeats.
+        self.llm = ChatOpenRouter(cache=False, max_tokens=MAX_TOKENS)
+        # Latest pending completion task per session
+        self.pending: dict[str, asyncio.Task] = {}
+
+    def schedule(self, session_id: str, websocket: WebSocket, data: dict):
+        """Cancel any in-flight completion for the session and debounce a new one"""
+        previous = self.pending.get(session_id)
+        if previous and not previous.done():
+            previous.cancel()
+        self.pending[session_id] = asyncio.create_task(
+            self._complete_after_debounce(websocket, data)
+        )
+
+    def cancel(self, session_id: str):
+        task = self.pending.pop(session_id, None)
+        if task and not task.done():
+            task.cancel()
+
+    async def _complete_after_debounce(self, websocket: WebSocket, data: dict):
+        try:
+            await asyncio.sleep(DEBOUNCE_SECONDS)
+            prefix, suffix = context_window(
+                data.get("prefix", data.get("content", "")),
+                data.get("suffix", "")
+            )
+            if not prefix.strip():
+                return
+            project_id = data.get("project_id", "default")
+            suggestion, cached = await self.get_completion(prefix, suffix, project_id)
+            await websocket.send_json({
+                "type": "suggestion",
+                "content": suggestion,
+                "position": data.get("cursor_position"),
+                "request_id": data.get("request_id"),
+                "cached": cached
+            })
+        except asyncio.CancelledError:
+            # Superseded by a newer keystroke
+            raise
+        except Exception as e:
+            logger.error(f"Error generating editor completion: {e}")
+            try:
+                await websocket.send_json({
+                    "type": "error",
+                    "content": f"Error generating suggestion: {str(e)}",
+                    "request_id": data.get("request_id")
+                })
+            except Exception:
+                pass
+
+    async def get_completion(self, prefix: str, suffix: str, project_id: str) -> tuple[str, bool]:
+        """Return (completion, cached), checking the Redis prefix cache first"""
+        key = cache_key(prefix, suffix, project_id)
+        try:
+            cached = await asyncio.to_thread(redis_breaker.call, redis_client.get, key)
+            if cached is not None:
+                return cached, True
+        except Exception as e:
+            logger.error(f"Error reading editor completion cache: {e}")
+
+        # Retrieve a little context from the same vector index as chat
+        chunks = await asyncio.to_thread(
+            vector_indexer.search_similar_chunks,
+            query=prefix[-500:],
+            project_id=project_id,
+            top_k=2
+        )
+        messages = [
+            SystemMessage(content=EDITOR_PROMPT.format(
+                context="\n\n".join(chunks) if chunks else "None"
+            )),
+            HumanMessage(content=f"{prefix}<CURSOR>{suffix}")
+        ]
+        response = await openrouter_breaker.acall(self.llm.ainvoke, messages)
+        suggestion = response.content
+
+        try:
+            await asyncio.to_thread(redis_breaker.call, redis_client.set, key, suggestion, ex=CACHE_TTL_SECONDS)
+        except Exception as e:
+            logger.error(f"Error writing editor completion cache: {e}")
+        return suggestion, False
+
+
+editor_manager = EditorManager()
+
+
+async def editor_endpoint(websocket: WebSocket, session_id: str = None):
+    await websocket.accept()
+    session_id = session_id or str(uuid.uuid4())
+    logger.info(f"Editor session {session_id}: Connection established")
+
+    try:
+        while True:
+            data = json.loads(await websocket.receive_text())
+            message_type = data.get("type")
+            if message_type in ("editor_context", "autocomplete_request"):
+                editor_manager.schedule(session_id, websocket, data)
+            elif message_type == "cancel":
+                editor_manager.cancel(session_id)
+            elif message_type == "ping":
+                await websocket.send_json({"type": "pong"})
+    except WebSocketDisconnect:
+        logger.info(f"Editor session {session_id}: WebSocket disconnected")
+    except Exception as e:
+        logger.error(f"Editor session {session_id}: Error in editor endpoint: {str(e)}")
+    finally:
+        editor_manager.cancel(session_id)
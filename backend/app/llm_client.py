@@ -9,6 +9,7 @@ from langchain_openai import ChatOpenAI
 from langchain.globals import set_llm_cache
 from langchain.cache import RedisSemanticCache
 from langchain_huggingface import HuggingFaceEmbeddings
+from app.resilience import redis_breaker
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -16,10 +17,29 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+class GuardedRedisSemanticCache(RedisSemanticCache):
+    """Semantic cache that is skipped while the Redis circuit is open"""
+
+    def lookup(self, prompt: str, llm_string: str):
+        try:
+            return redis_breaker.call(super().lookup, prompt, llm_string)
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup skipped: {e}")
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val):
+        try:
+            redis_breaker.call(super().update, prompt, llm_string, return_val)
+        except Exception as e:
+            logger.warning(f"Semantic cache update skipped: {e}")
+
 class ChatOpenRouter(ChatOpenAI):
     """Simplified OpenRouter chat model with OpenAI compatibility"""
     
     def __init__(self, **kwargs):
+        # Bound request time so a stalled upstream trips the circuit breaker
+        kwargs.setdefault("timeout", float(os.getenv("OPENROUTER_TIMEOUT", 60)))
+        kwargs.setdefault("max_retries", int(os.getenv("OPENROUTER_MAX_RETRIES", 1)))
         # First initialize the parent class
         super().__init__(
             model=os.getenv("OPENROUTER_MODEL", "microsoft/mai-ds-r1:free"),
@@ -32,6 +52,10 @@ class ChatOpenRouter(ChatOpenAI):
             **kwargs
         )
         
+        # Instances that opt out of caching don't need the global semantic cache
+        if kwargs.get("cache") is False:
+            return
+        
         # Initialize Redis Semantic Cache after parent is initialized
         redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
         
@@ -45,7 +69,7 @@ class ChatOpenRouter(ChatOpenAI):
             )
             
             # Create cache with required parameters
-            redis_cache = RedisSemanticCache(
+            redis_cache = GuardedRedisSemanticCache(
                 redis_url=redis_url,
                 embedding=embeddings
             )
@@ -6,20 +6,27 @@ file ingestion, and document upload. It also configures CORS and initializes
 the necessary components for the application to run.
 """
 
-from fastapi import FastAPI, WebSocket, Request, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, WebSocket, Request, HTTPException, UploadFile, File, Form, Header
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 from app.websocket_chat import chat_endpoint
-from app.vector_indexer import vector_indexer
+from app.editor_completion import editor_endpoint
+from app.vector_indexer import vector_indexer, QuotaExceededError
+from app.document_extraction import extract_documents, shutdown_extraction_pool, SUPPORTED_CONTENT_TYPES
 import os
+import asyncio
+import secrets
 import tempfile
 from pathlib import Path
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from dotenv import load_dotenv
 from storage3.exceptions import StorageApiError
-from typing import List
+from typing import List, Optional
+from pydantic import BaseModel, Field, StrictInt
 from app.shared_resources import supabase
+from app.session_state import session_cache, write_behind
+from app.profiling import aggregator as profile_aggregator, profile_request, PROFILING_ENABLED
+from app.resilience import supabase_breaker, breaker_status, CircuitOpenError, OPEN
 
 # Load environment variables from .env file
 load_dotenv()
@@ -41,10 +48,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup():
+    """Start the Supabase write-behind flusher"""
+    write_behind.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Flush pending Supabase writes and release the document extraction process pool"""
+    await write_behind.stop()
+    shutdown_extraction_pool()
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {"status": "ok"}
+    """Health check endpoint, including cached dependency circuit state"""
+    dependencies = breaker_status()
+    degraded = any(dep["state"] == OPEN for dep in dependencies.values())
+    return {
+        "status": "degraded" if degraded else "ok",
+        "dependencies": dependencies,
+        "session_state": session_cache.stats()
+    }
+
+def _check_admin_token(token: Optional[str]):
+    """Admin endpoints require ADMIN_TOKEN and are disabled when it is not configured"""
+    expected = os.getenv("ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token or not secrets.compare_digest(token.encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/profiling")
+async def profiling_report(limit: int = 20, x_admin_token: Optional[str] = Header(None)):
+    """Aggregated CPU and allocation hot spots for profiled requests"""
+    _check_admin_token(x_admin_token)
+    return {"enabled": PROFILING_ENABLED, "stages": profile_aggregator.report(limit)}
+
+@app.delete("/admin/profiling")
+async def reset_profiling(x_admin_token: Optional[str] = Header(None)):
+    """Clear aggregated profiling data"""
+    _check_admin_token(x_admin_token)
+    profile_aggregator.reset()
+    return {"status": "reset"}
+
+@app.get("/admin/index-stats")
+async def index_stats(x_admin_token: Optional[str] = Header(None)):
+    """Vector index statistics aggregated across Redis shards"""
+    _check_admin_token(x_admin_token)
+    return vector_indexer.index_stats()
+
+@app.get("/admin/quotas/{project_id}")
+async def get_project_quota(project_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Effective quotas and shard placement for a project"""
+    _check_admin_token(x_admin_token)
+    try:
+        quota = await asyncio.to_thread(vector_indexer.get_quota, project_id)
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {
+        "project_id": project_id,
+        "shard": vector_indexer.ring.node_name(project_id),
+        **quota
+    }
+
+class QuotaUpdate(BaseModel):
+    """Quota overrides; omitted fields are left unchanged, 0 means unlimited"""
+    max_vectors: Optional[StrictInt] = Field(None, ge=0)
+    max_qps: Optional[StrictInt] = Field(None, ge=0)
+
+@app.put("/admin/quotas/{project_id}")
+async def set_project_quota(project_id: str, quota: QuotaUpdate, x_admin_token: Optional[str] = Header(None)):
+    """Override a project's max_vectors and/or max_qps quota"""
+    _check_admin_token(x_admin_token)
+    try:
+        await asyncio.to_thread(vector_indexer.set_quota, project_id, quota.max_vectors, quota.max_qps)
+        updated = await asyncio.to_thread(vector_indexer.get_quota, project_id)
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"project_id": project_id, **updated}
 
 @app.websocket("/chat")
 async def websocket_endpoint(websocket: WebSocket):
@@ -56,6 +137,16 @@ async def websocket_endpoint_with_thread(websocket: WebSocket, thread_id: str):
     """WebSocket endpoint for chat with thread ID"""
     await chat_endpoint(websocket, thread_id)
 
+@app.websocket("/ws/editor")
+async def websocket_editor_endpoint(websocket: WebSocket):
+    """WebSocket endpoint for inline editor suggestions"""
+    await editor_endpoint(websocket)
+
+@app.websocket("/ws/editor/{session_id}")
+async def websocket_editor_endpoint_with_session(websocket: WebSocket, session_id: str):
+    """WebSocket endpoint for inline editor suggestions with session ID"""
+    await editor_endpoint(websocket, session_id)
+
 
 @app.post("/ingest")
 async def ingest_documents(request: Request):
@@ -63,73 +154,159 @@ async def ingest_documents(request: Request):
     data = await request.json()
     project_id = data.get("project_id")
     text = data.get("text")
+    document_id = data.get("document_id")
     if not project_id or not text:
         raise HTTPException(status_code=400, detail="project_id and text are required")
     logger.info(f"Received ingestion request: project_id={project_id}, text_length={len(text)}")
-    count = vector_indexer.ingest(project_id, text)
-    logger.info(f"Indexed {count} chunks for project_id={project_id}")
-    return {"ingested_chunks": count}
+    try:
+        stats = vector_indexer.ingest(project_id, text, document_id)
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    logger.info(f"Indexed {stats['added']} new chunks for project_id={project_id}, skipped {stats['skipped']}")
+    return {
+        "ingested_chunks": stats["added"],
+        "skipped_chunks": stats["skipped"],
+        "removed_chunks": stats["removed"],
+        "deleted_chunks": stats["deleted"]
+    }
 
-@app.post("/upload-document")
-async def upload_document(conversation_id: str = Form(...), file: UploadFile = File(...)):
-    """Upload a document, extract text, index into Redis, and store in Supabase."""
+async def _extract_chunks(file: UploadFile, contents: bytes) -> List[str]:
+    """Extract a file in the process pool and split it into text chunks"""
     # Save to temp file
     suffix = Path(file.filename).suffix
-    contents = await file.read()
     with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
         tmp.write(contents)
         tmp_path = tmp.name
     logger.info(f"Saved upload to {tmp_path}")
-    # Load document
-    if file.content_type == "application/pdf":
-        loader = PyPDFLoader(tmp_path)
-        documents = loader.load()
-    elif file.content_type in ["text/plain", "text/markdown"]:
-        loader = TextLoader(tmp_path, encoding="utf-8")
-        documents = loader.load()
-    elif file.content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        loader = Docx2txtLoader(tmp_path)
-        documents = loader.load()
-    else:
-        raise HTTPException(status_code=415, detail="Unsupported file type")
-    # Chunk text
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    docs = splitter.split_documents(documents)
-    logger.info(f"Split document into {len(docs)} chunks")
-    # Index text chunks via shared vector_indexer
-    text_chunks = [doc.page_content for doc in docs]
-    count = vector_indexer.ingest_chunks(conversation_id, text_chunks)
-    logger.info(f"Indexed {count} chunks for conversation {conversation_id}")
-    # Cleanup temp file
-    os.remove(tmp_path)
+    try:
+        # Chunk pages as they stream back from the extraction pool
+        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+        docs = []
+        async for batch in extract_documents(tmp_path, file.content_type):
+            docs.extend(splitter.split_documents(batch))
+        logger.info(f"Split {file.filename} into {len(docs)} chunks")
+        return [doc.page_content for doc in docs]
+    finally:
+        # Cleanup temp file
+        os.remove(tmp_path)
+
+def _store_upload(conversation_id: str, file: UploadFile, contents: bytes, chunk_count: int,
+                  record: bool = True):
+    """
+    Upload the original file to Supabase storage and, if record is set, queue
+    its metadata row. Re-uploads overwrite the stored file.
+    """
     # Upload to Supabase storage (ensure bucket exists)
     bucket_id = "chat-files"
     storage = supabase.storage
     path = f"{conversation_id}/{file.filename}"
+    file_options = {"content-type": file.content_type, "upsert": "true"}
     try:
         bucket = storage.from_(bucket_id)
-        bucket.upload(path, contents)
+        supabase_breaker.call(bucket.upload, path, contents, file_options)
     except StorageApiError as e:
         # Create bucket if missing
         if getattr(e, 'statusCode', None) == 404 or "Bucket not found" in str(e):
-            storage.create_bucket(bucket_id, public=True)
+            supabase_breaker.call(storage.create_bucket, bucket_id, public=True)
             bucket = storage.from_(bucket_id)
-            bucket.upload(path, contents)
+            supabase_breaker.call(bucket.upload, path, contents, file_options)
         else:
-            raise HTTPException(status_code=500, detail=f"Storage upload error: {e}")
+            raise
     # get_public_url returns a direct URL string
     public_url = bucket.get_public_url(path)
     logger.info(f"Uploaded file to Supabase: {public_url}")
-    # Store metadata in Supabase
-    try:
-        supabase.table("documents").insert({
-            "conversation_id": conversation_id,
-            "filename": file.filename,
-            "content_type": file.content_type,
-            "chunk_count": count,
-            "size_bytes": len(contents)
-        }).execute()
-    except Exception as e:
-        logger.error(f"Failed to store document metadata: {e}")
-        # Don't fail the request if metadata storage fails
-    return {"status": "success", "chunks_indexed": count, "conversation_id": conversation_id}
\ No newline at end of file
+    if not record:
+        return
+    # Store metadata in Supabase asynchronously via the write-behind queue
+    write_behind.enqueue("documents", {
+        "conversation_id": conversation_id,
+        "file_name": file.filename,
+        "file_url": public_url,
+        "file_type": file.content_type,
+        "ingested_chunks": chunk_count
+    })
+
+@app.post("/upload-document")
+async def upload_document(
+    conversation_id: str = Form(...),
+    file: Optional[UploadFile] = File(None),
+    files: Optional[List[UploadFile]] = File(None),
+    profile: bool = Form(False)
+):
+    """Upload one or more documents, extract text, index into Redis, and store in Supabase."""
+    uploads = ([file] if file else []) + (files or [])
+    if not uploads:
+        raise HTTPException(status_code=400, detail="At least one file is required")
+    if not vector_indexer.is_available(conversation_id):
+        raise HTTPException(status_code=503, detail="Vector store unavailable, try again later")
+    if supabase_breaker.is_open:
+        raise HTTPException(status_code=503, detail="File storage unavailable, try again later")
+    for upload in uploads:
+        if upload.content_type not in SUPPORTED_CONTENT_TYPES:
+            raise HTTPException(status_code=415, detail=f"Unsupported file type: {upload.filename}")
+
+    contents = [await upload.read() for upload in uploads]
+    # Extract every file concurrently so bulk uploads use all pool workers
+    chunk_lists = await asyncio.gather(*[
+        _extract_chunks(upload, data)
+        for upload, data in zip(uploads, contents)
+    ])
+
+    documents = []
+    for upload, data, text_chunks in zip(uploads, contents, chunk_lists):
+        # Index text chunks via shared vector_indexer; unchanged chunks are not re-embedded
+        try:
+            async with profile_request(profile):
+                # Embedding is CPU-bound; keep it off the event loop
+                stats = await asyncio.to_thread(
+                    vector_indexer.ingest_chunks, conversation_id, text_chunks, document_id=upload.filename
+                )
+        except QuotaExceededError as e:
+            # Earlier files are indexed and stored already; report this one and move on
+            logger.warning(f"Skipped indexing {upload.filename}: {e}")
+            documents.append({
+                "filename": upload.filename,
+                "chunks_indexed": 0,
+                "chunks_skipped": 0,
+                "chunks_removed": 0,
+                "chunks_deleted": 0,
+                "stored": False,
+                "quota_error": str(e)
+            })
+            continue
+        logger.info(f"Indexed {stats['added']} new chunks for conversation {conversation_id}, "
+                    f"skipped {stats['skipped']}, removed {stats['removed']}, deleted {stats['deleted']}")
+        document = {
+            "filename": upload.filename,
+            "chunks_indexed": stats["added"],
+            "chunks_skipped": stats["skipped"],
+            "chunks_removed": stats["removed"],
+            "chunks_deleted": stats["deleted"],
+            "stored": True
+        }
+        try:
+            # A re-ingested document already has its metadata row
+            await asyncio.to_thread(
+                _store_upload, conversation_id, upload, data, stats["total"],
+                not stats["reingested"]
+            )
+        except Exception as e:
+            # The chunks are indexed already; report the storage failure instead of failing the request
+            logger.error(f"Skipped storing {upload.filename}: {e}")
+            document["stored"] = False
+            document["storage_error"] = str(e)
+        documents.append(document)
+
+    if all("quota_error" in doc for doc in documents):
+        # Nothing was indexed, so the request as a whole is over quota
+        raise HTTPException(status_code=429, detail=documents[0]["quota_error"])
+
+    return {
+        "status": "success" if all(doc["stored"] for doc in documents) else "partial",
+        "chunks_indexed": sum(doc["chunks_indexed"] for doc in documents),
+        "chunks_skipped": sum(doc["chunks_skipped"] for doc in documents),
+        "chunks_removed": sum(doc["chunks_removed"] for doc in documents),
+        "chunks_deleted": sum(doc["chunks_deleted"] for doc in documents),
+        "documents": documents,
+        "conversation_id": conversation_id
+    }
@@ -0,0 +1,256 @@
+"""
+Opt-in CPU and memory profiling for the agent pipeline.
+
+Profiling is off unless PROFILING_ENABLED is set. When enabled, a request is
+profiled if the client asks for it (a `profile` flag) or it is picked by
+PROFILE_SAMPLE_RATE. Inside a profiled request each stage (retrieve, generate,
+ingest) is run under cProfile and, if PROFILE_MEMORY is set, a tracemalloc
+snapshot diff. Async stages are profiled only while their own code runs; time
+spent suspended on I/O is reported separately as awaited time. Results are
+aggregated per stage and served by the admin endpoint. Outside a profiled request a stage costs one context variable
+lookup.
+"""
+
+import os
+import time
+import types
+import random
+import functools
+import inspect
+import cProfile
+import pstats
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_MEMORY = os.getenv("PROFILE_MEMORY", "false").lower() == "true"
+
+# Set for the duration of a profiled request
+_profiling_request: ContextVar[bool] = ContextVar("profiling_request", default=False)
+# cProfile hooks are per thread (setprofile on 3.11); only one stage may own a thread's hook
+_thread_state = threading.local()
+
+
+class ProfileAggregator:
+    """Accumulates cProfile stats and allocation diffs per pipeline stage"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, pstats.Stats] = {}
+        self._allocations: Dict[str, Counter] = {}
+        self._samples: Counter = Counter()
+        self._wall_time: Counter = Counter()
+        self._awaited_time: Counter = Counter()
+        self._tracing_requests = 0
+
+    def start_tracing(self):
+        with self._lock:
+            self._tracing_requests += 1
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    def stop_tracing(self):
+        with self._lock:
+            self._tracing_requests -= 1
+            if self._tracing_requests == 0 and tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    def add(self, stage: str, profiler: Optional[cProfile.Profile],
+            before: Optional[tracemalloc.Snapshot], after: Optional[tracemalloc.Snapshot],
+            wall_time: float = 0.0, awaited_time: float = 0.0):
+        with self._lock:
+            self._samples[stage] += 1
+            self._wall_time[stage] += wall_time
+            self._awaited_time[stage] += awaited_time
+            if profiler is not None:
+                if stage in self._stats:
+                    self._stats[stage].add(profiler)
+                else:
+                    self._stats[stage] = pstats.Stats(profiler)
+            if before is not None and after is not None:
+                allocations = self._allocations.setdefault(stage, Counter())
+                for diff in after.compare_to(before, "lineno"):
+                    frame = diff.traceback[0]
+                    allocations[f"{frame.filename}:{frame.lineno}"] += diff.size_diff
+
+    def report(self, limit: int = 20) -> Dict[str, Any]:
+        """Top functions by cumulative time and top allocation sites, per stage"""
+        with self._lock:
+            report = {}
+            for stage, samples in self._samples.items():
+                entry: Dict[str, Any] = {
+                    "samples": samples,
+                    "wall_time": round(self._wall_time[stage], 6),
+                    "awaited_time": round(self._awaited_time[stage], 6)
+                }
+                stats = self._stats.get(stage)
+                if stats is not None:
+                    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+                    entry["cpu"] = [
+                        {
+                            "function": f"{filename}:{line}({func})",
+                            "calls": nc,
+                            "total_time": round(tt, 6),
+                            "cumulative_time": round(ct, 6)
+                        }
+                        for (filename, line, func), (cc, nc, tt, ct, callers) in rows[:limit]
+                    ]
+                allocations = self._allocations.get(stage)
+                if allocations:
+                    entry["memory"] = [
+                        {"location": location, "size_diff_bytes": size}
+                        for location, size in allocations.most_common(limit)
+                    ]
+                report[stage] = entry
+            return report
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._allocations.clear()
+            self._samples.clear()
+            self._wall_time.clear()
+            self._awaited_time.clear()
+
+
+aggregator = ProfileAggregator()
+
+
+def should_profile(requested: bool = False) -> bool:
+    """Decide whether to profile a request: explicit flag or random sample"""
+    if not PROFILING_ENABLED:
+        return False
+    return requested or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+
+
+@asynccontextmanager
+async def profile_request(requested: bool = False):
+    """Mark the current task as profiled for its duration"""
+    if not should_profile(requested):
+        yield False
+        return
+    token = _profiling_request.set(True)
+    if PROFILE_MEMORY:
+        aggregator.start_tracing()
+    try:
+        yield True
+    finally:
+        if PROFILE_MEMORY:
+            aggregator.stop_tracing()
+        _profiling_request.reset(token)
+
+
+def _enable(profiler: cProfile.Profile) -> bool:
+    """Enable profiler on this thread, or return False if a stage already owns it"""
+    if getattr(_thread_state, "active", False):
+        return False
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiling tool is active (sys.monitoring on Python 3.12+)
+        return False
+    _thread_state.active = True
+    return True
+
+
+def _disable(profiler: cProfile.Profile):
+    profiler.disable()
+    _thread_state.active = False
+
+
+def _snapshot() -> Optional[tracemalloc.Snapshot]:
+    return tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+
+
+@contextmanager
+def profile_stage(stage: str):
+    """Profile a synchronous pipeline stage if the current request is profiled"""
+    if not _profiling_request.get():
+        yield
+        return
+    profiler = cProfile.Profile()
+    if not _enable(profiler):
+        # Overlapping stage on this thread; skip rather than corrupt its profile
+        yield
+        return
+    before = _snapshot()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _disable(profiler)
+        wall_time = time.perf_counter() - started
+        after = _snapshot() if before is not None else None
+        aggregator.add(stage, profiler, before, after, wall_time)
+
+
+@types.coroutine
+def _profile_coroutine(stage: str, coro):
+    """
+    Drive coro step by step, profiling only the steps it runs synchronously.
+
+    While coro is suspended the loop runs other tasks; the profiler is off
+    then, so their work is not charged to this stage and their own stages
+    can be profiled. Suspended time is recorded as the stage's awaited time.
+    """
+    profiler = cProfile.Profile()
+    profiled_steps = 0
+    awaited_time = 0.0
+    before = _snapshot()
+    started = time.perf_counter()
+    to_send, to_throw = None, None
+    try:
+        while True:
+            owned = _enable(profiler)
+            try:
+                if to_throw is not None:
+                    yielded = coro.throw(to_throw)
+                else:
+                    yielded = coro.send(to_send)
+            except StopIteration as done:
+                return done.value
+            finally:
+                if owned:
+                    _disable(profiler)
+                    profiled_steps += 1
+            suspended = time.perf_counter()
+            try:
+                to_send, to_throw = (yield yielded), None
+            except GeneratorExit:
+                coro.close()
+                raise
+            except BaseException as e:
+                # Cancellation and other throws are delivered to the stage itself
+                to_send, to_throw = None, e
+            awaited_time += time.perf_counter() - suspended
+    finally:
+        wall_time = time.perf_counter() - started
+        after = _snapshot() if before is not None else None
+        aggregator.add(stage, profiler if profiled_steps else None, before, after, wall_time, awaited_time)
+
+
+def profiled(stage: str):
+    """Decorator profiling a sync function under profile_stage, or an async one step by step"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not _profiling_request.get():
+                    return await func(*args, **kwargs)
+                return await _profile_coroutine(stage, func(*args, **kwargs))
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile_stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,194 @@
+"""
+Circuit breakers for the backend's external dependencies.
+
+Each dependency (Redis, Supabase, OpenRouter) has a breaker that opens after
+consecutive connection failures. While open, calls fail immediately with
+CircuitOpenError instead of waiting for a timeout; after a cool-down a single
+trial call is let through to probe whether the dependency has recovered.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, Tuple, Type
+
+import httpx
+import openai
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the dependency's breaker is open"""
+
+    def __init__(self, name: str):
+        super().__init__(f"{name} is unavailable (circuit open)")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    Only exceptions listed in `failure_exceptions` count as dependency
+    failures; anything else (e.g. a missing index) means the dependency
+    answered and is treated as a success.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_exceptions: Tuple[Type[BaseException], ...],
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0
+    ):
+        self.name = name
+        self.failure_exceptions = failure_exceptions
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        # Counters reported by /health
+        self.total_failures = 0
+        self.total_rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == OPEN
+
+    def allow_request(self) -> bool:
+        """Return True if a call may proceed, reserving the trial slot when half-open"""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.total_rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info(f"Circuit {self.name} closed")
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self.total_failures += 1
+            self._trial_in_flight = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.times_opened += 1
+                    logger.warning(f"Circuit {self.name} opened after {self._failures} failures")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """Call func through the breaker"""
+        if not self.allow_request():
+            raise CircuitOpenError(self.name)
+        try:
+            result = func(*args, **kwargs)
+        except self.failure_exceptions:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    async def acall(self, func: Callable, *args, **kwargs) -> Any:
+        """Await func through the breaker"""
+        if not self.allow_request():
+            raise CircuitOpenError(self.name)
+        try:
+            result = await func(*args, **kwargs)
+        except self.failure_exceptions:
+            self.record_failure()
+            raise
+        except asyncio.CancelledError:
+            # Cancellation says nothing about dependency health
+            with self._lock:
+                self._trial_in_flight = False
+            raise
+        except BaseException:
+            self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "total_failures": self.total_failures,
+            "rejected_calls": self.total_rejected,
+            "times_opened": self.times_opened
+        }
+
+
+FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 3))
+RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+
+# Redis errors that mean the node is unreachable
+REDIS_FAILURES = (RedisConnectionError, RedisTimeoutError)
+
+redis_breaker = CircuitBreaker(
+    "redis",
+    REDIS_FAILURES,
+    FAILURE_THRESHOLD,
+    RESET_TIMEOUT
+)
+supabase_breaker = CircuitBreaker(
+    "supabase",
+    (httpx.TransportError,),
+    FAILURE_THRESHOLD,
+    RESET_TIMEOUT
+)
+openrouter_breaker = CircuitBreaker(
+    "openrouter",
+    (openai.APIConnectionError, openai.InternalServerError),
+    FAILURE_THRESHOLD,
+    RESET_TIMEOUT
+)
+
+breakers = {
+    breaker.name: breaker
+    for breaker in (redis_breaker, supabase_breaker, openrouter_breaker)
+}
+
+
+def register_breaker(breaker: CircuitBreaker) -> CircuitBreaker:
+    """Add a breaker to the registry reported by /health"""
+    breakers[breaker.name] = breaker
+    return breaker
+
+
+def breaker_status() -> Dict[str, Dict[str, Any]]:
+    """Current state of every dependency breaker"""
+    return {name: breaker.status() for name, breaker in breakers.items()}
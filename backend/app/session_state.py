@@ -0,0 +1,245 @@
+"""
+Per-thread session state with write-behind persistence to Supabase.
+
+Thread history lives in a Redis list that every instance appends to
+atomically, so instances never overwrite each other's messages. An in-process
+LRU copy of each thread is refreshed on every read and served only while
+Redis is unavailable. Document metadata, and messages of
+threads tied to an existing Supabase conversation, are queued and written to
+Supabase in batches by a background task that flushes on a timer or once the
+queue reaches its size limit, so persistence never adds latency to a chat
+turn. Messages are only persisted when the client passes its Supabase
+conversation_id on connect; otherwise the frontend owns message storage.
+"""
+
+import os
+import json
+import asyncio
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.shared_resources import redis_client, supabase
+from app.resilience import redis_breaker, supabase_breaker, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# Threads kept in memory before the least recently used is evicted
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 1000))
+# Messages kept per thread in the hot cache and in Redis
+HISTORY_LIMIT = 20
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", 2))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 100))
+# Rows retained for retry while Supabase is unavailable
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", 10000))
+
+# Failures worth retrying later; anything else means the row itself is bad
+TRANSIENT_ERRORS = (CircuitOpenError, httpx.TransportError)
+
+
+def parse_conversation_id(value: Optional[str]) -> Optional[str]:
+    """Return value if it is a valid Supabase conversation UUID, else None"""
+    if not value:
+        return None
+    try:
+        return str(uuid.UUID(value))
+    except ValueError:
+        logger.warning(f"Ignoring invalid conversation_id: {value}")
+        return None
+
+
+class WriteBehindQueue:
+    """Buffers Supabase rows and writes them in batches from a background task"""
+
+    def __init__(self, interval: float, batch_size: int, max_pending: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._rows: List[Tuple[str, Dict[str, Any]]] = []
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def enqueue(self, table: str, row: Dict[str, Any]):
+        """Queue a row for insertion; safe from any thread"""
+        with self._lock:
+            self._rows.append((table, row))
+            if len(self._rows) > self.max_pending:
+                dropped = len(self._rows) - self.max_pending
+                self._rows = self._rows[dropped:]
+                logger.error(f"Write-behind queue full, dropped {dropped} oldest rows")
+            full = len(self._rows) >= self.batch_size
+        if full and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def start(self):
+        """Start the background flusher on the running event loop"""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+            logger.info("Write-behind queue started")
+
+    async def stop(self):
+        """Stop the flusher and write whatever is still queued"""
+        if self._task is not None:
+            # Let a flush in progress finish rather than cancel it mid-write
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        logger.info("Write-behind queue stopped")
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """
+        Write all queued rows.
+
+        Batches that fail transiently are re-queued. A batch rejected by
+        Supabase is retried row by row so one bad row is dropped on its own.
+        """
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if not rows:
+            return
+
+        batches: Dict[str, List[Dict[str, Any]]] = {}
+        for table, row in rows:
+            batches.setdefault(table, []).append(row)
+
+        retry = []
+        for table, batch in batches.items():
+            try:
+                await self._write(table, batch)
+                logger.info(f"Wrote {len(batch)} rows to {table}")
+            except TRANSIENT_ERRORS as e:
+                logger.warning(f"Deferring {len(batch)} rows for {table}: {e}")
+                retry.extend((table, row) for row in batch)
+            except Exception as e:
+                logger.warning(f"Batch of {len(batch)} rows rejected by {table}, writing rows individually: {e}")
+                for row in batch:
+                    try:
+                        await self._write(table, [row])
+                    except TRANSIENT_ERRORS:
+                        retry.append((table, row))
+                    except Exception as row_error:
+                        logger.error(f"Dropping row rejected by {table}: {row_error} ({row})")
+
+        if retry:
+            with self._lock:
+                self._rows = retry + self._rows
+
+    @staticmethod
+    async def _write(table: str, batch: List[Dict[str, Any]]):
+        await asyncio.to_thread(supabase_breaker.call, supabase.table(table).insert(batch).execute)
+
+
+class SessionStateCache:
+    """Per-thread history in Redis lists, with an LRU fallback copy in memory"""
+
+    def __init__(self, max_threads: int, queue: WriteBehindQueue):
+        self.max_threads = max_threads
+        self.queue = queue
+        self._threads: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _redis_key(self, thread_id: str) -> str:
+        return f"conversation:{thread_id}:messages"
+
+    def _remember(self, thread_id: str, history: List[Dict[str, Any]]):
+        with self._lock:
+            self._threads[thread_id] = history
+            self._threads.move_to_end(thread_id)
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+
+    def get_messages(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Return the thread's recent messages from Redis, or the cached copy if Redis is down"""
+        try:
+            stored = redis_breaker.call(redis_client.lrange, self._redis_key(thread_id), -HISTORY_LIMIT, -1)
+            history = [json.loads(message) for message in stored]
+        except Exception as e:
+            logger.error(f"Error getting conversation history: {e}")
+            with self._lock:
+                history = self._threads.get(thread_id)
+                if history is None:
+                    return []
+                self._threads.move_to_end(thread_id)
+                return list(history)
+        self._remember(thread_id, history)
+        return list(history)
+
+    def append_message(self, thread_id: str, role: str, content: str,
+                       thinking_steps: Optional[List[str]] = None,
+                       conversation_id: Optional[str] = None):
+        """
+        Append a message to the thread's Redis list. It is queued for Supabase
+        only when the thread belongs to an existing Supabase conversation.
+        """
+        message = {
+            "role": role,
+            "content": content,
+            "timestamp": datetime.now().isoformat()
+        }
+        key = self._redis_key(thread_id)
+
+        def push():
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.rpush(key, json.dumps(message))
+            pipe.ltrim(key, -HISTORY_LIMIT, -1)
+            pipe.execute()
+
+        try:
+            redis_breaker.call(push)
+        except Exception as e:
+            logger.error(f"Error updating conversation history: {e}")
+
+        # Keep the fallback copy in step with what this instance has seen
+        with self._lock:
+            history = list(self._threads.get(thread_id, []))
+        history.append(message)
+        self._remember(thread_id, history[-HISTORY_LIMIT:])
+
+        if conversation_id:
+            self.queue.enqueue("messages", {
+                "conversation_id": conversation_id,
+                "role": role,
+                "content": content,
+                # Stored as a JSON string, as lib/supabase/db.ts does
+                "thinking_steps": json.dumps(thinking_steps) if thinking_steps else None,
+                "created_at": datetime.now(timezone.utc).isoformat()
+            })
+
+    def evict(self, thread_id: str):
+        with self._lock:
+            self._threads.pop(thread_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            cached = len(self._threads)
+        return {"cached_threads": cached, "pending_writes": self.queue.pending()}
+
+
+write_behind = WriteBehindQueue(WRITE_BEHIND_INTERVAL, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_MAX_PENDING)
+session_cache = SessionStateCache(SESSION_CACHE_SIZE, write_behind)
@@ -0,0 +1,52 @@
+"""
+Consistent-hash placement of project indexes across Redis nodes.
+
+Nodes are listed in REDIS_SHARDS as comma-separated host:port pairs. Each
+node owns many virtual points on a hash ring, so adding a node moves only
+about 1/N of the projects. Existing data is not migrated automatically; a
+moved project must be re-ingested on its new node.
+"""
+
+import bisect
+import hashlib
+from typing import Dict, Generic, List, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def _hash(key: str) -> int:
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+def parse_shards(spec: str) -> List[Tuple[str, int]]:
+    """Parse 'host:port,host:port' into (host, port) pairs"""
+    shards = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.rpartition(":")
+        shards.append((host, int(port)) if host else (entry, 6379))
+    return shards
+
+
+class ShardRing(Generic[T]):
+    """Maps keys to nodes by consistent hashing with virtual nodes"""
+
+    def __init__(self, nodes: Dict[str, T], replicas: int = 128):
+        if not nodes:
+            raise ValueError("ShardRing needs at least one node")
+        self.nodes = nodes
+        self._ring: List[Tuple[int, str]] = sorted(
+            (_hash(f"{name}#{i}"), name)
+            for name in nodes
+            for i in range(replicas)
+        )
+        self._points = [point for point, _ in self._ring]
+
+    def node_name(self, key: str) -> str:
+        index = bisect.bisect(self._points, _hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+    def get(self, key: str) -> T:
+        return self.nodes[self.node_name(key)]
@@ -21,7 +21,10 @@ logger = logging.getLogger(__name__)
 redis_client = Redis(
     host=os.getenv('REDIS_HOST', 'redis'),
     port=int(os.getenv('REDIS_PORT', 6379)),
-    decode_responses=True
+    decode_responses=True,
+    # Tight timeouts so an unreachable Redis fails fast and trips its circuit breaker
+    socket_timeout=float(os.getenv('REDIS_SOCKET_TIMEOUT', 2)),
+    socket_connect_timeout=float(os.getenv('REDIS_CONNECT_TIMEOUT', 1))
 )
 
 logger.info("Shared Redis client initialized")
@@ -1,39 +1,173 @@
 from typing import List, Optional, Dict, Any
+import os
+import time
+import hashlib
 import logging
+import threading
 import numpy as np
 from redis import Redis
 from redis.commands.search.field import VectorField, TextField
 from redis.commands.search.indexDefinition import IndexDefinition, IndexType
 from redisvl.utils.vectorize.text.huggingface import HFTextVectorizer
+from app.resilience import (
+    CircuitBreaker, CircuitOpenError, register_breaker, REDIS_FAILURES, FAILURE_THRESHOLD, RESET_TIMEOUT
+)
+from app.profiling import profiled
+from app.sharding import ShardRing, parse_shards
 
 def chunk_text(text: str, chunk_size: int = 500) -> List[str]:
     """Split text into chunks of approximately chunk_size characters."""
     return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
 
+def content_hash(text: str) -> str:
+    """Return a stable content hash for a text chunk."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
 logger = logging.getLogger(__name__)
 
+# Default per-project quotas; 0 means unlimited. Overrides live in rag_quota:{project_id}
+DEFAULT_MAX_VECTORS = int(os.getenv("PROJECT_MAX_VECTORS", 0))
+DEFAULT_MAX_QPS = int(os.getenv("PROJECT_MAX_QPS", 0))
+# Seconds a project's quota is cached in-process before it is re-read from Redis
+QUOTA_CACHE_TTL = float(os.getenv("QUOTA_CACHE_TTL", 5))
+QUOTA_CACHE_SIZE = 10000
+
+# Drop a document reference (ARGV[1] == 'refs') or the ad-hoc pin
+# (ARGV[1] == 'pinned') from a chunk, deleting it atomically once it has
+# neither
+RELEASE_CHUNK_SCRIPT = """
+if ARGV[1] == 'pinned' then
+    redis.call('HDEL', KEYS[1], 'pinned')
+else
+    redis.call('HINCRBY', KEYS[1], 'refs', -1)
+end
+local refs = tonumber(redis.call('HGET', KEYS[1], 'refs') or '0')
+if refs <= 0 and redis.call('HEXISTS', KEYS[1], 'pinned') == 0 then
+    redis.call('DEL', KEYS[1])
+    return 1
+end
+return 0
+"""
+
+class QuotaExceededError(Exception):
+    """Raised when a project exceeds its stored-vector or query-rate quota"""
+
 class DocumentVectorIndexer:
     """
     Simplified Redis vector indexer with semantic search capabilities.
+
+    Project indexes are spread over the Redis nodes in REDIS_SHARDS by
+    consistent hashing; every key of a project lives on the same node. Each
+    node has its own circuit breaker, so one node failing only affects the
+    projects it holds.
     """
     
     def __init__(
         self,
         redis_host: str = 'localhost',
         redis_port: int = 6379,
-        model_name: str = "sentence-transformers/all-mpnet-base-v2"
+        model_name: str = "sentence-transformers/all-mpnet-base-v2",
+        shards: Optional[str] = None
     ):
-        self.redis = Redis(host=redis_host, port=redis_port, decode_responses=False)
+        shard_spec = shards or os.getenv("REDIS_SHARDS") or f"{redis_host}:{redis_port}"
+        self.ring = ShardRing({
+            f"{host}:{port}": Redis(
+                host=host,
+                port=port,
+                decode_responses=False,
+                socket_timeout=float(os.getenv('REDIS_SOCKET_TIMEOUT', 2)),
+                socket_connect_timeout=float(os.getenv('REDIS_CONNECT_TIMEOUT', 1))
+            )
+            for host, port in parse_shards(shard_spec)
+        })
+        self.breakers = {
+            name: register_breaker(
+                CircuitBreaker(f"redis:{name}", REDIS_FAILURES, FAILURE_THRESHOLD, RESET_TIMEOUT)
+            )
+            for name in self.ring.nodes
+        }
+        # project_id -> (loaded_at, quota); keeps quota lookups off the search hot path
+        self._quota_cache: Dict[str, tuple] = {}
+        self._quota_lock = threading.Lock()
         self.vectorizer = HFTextVectorizer(model=model_name)
         self.embedding_dim = 768  # Default for all-mpnet-base-v2
+
+    def _redis(self, project_id: str) -> Redis:
+        """Redis node holding the project's index"""
+        return self.ring.get(project_id)
+
+    def _breaker(self, project_id: str) -> CircuitBreaker:
+        """Circuit breaker of the node holding the project's index"""
+        return self.breakers[self.ring.node_name(project_id)]
+
+    def is_available(self, project_id: str) -> bool:
+        """False while the project's Redis node is known to be down"""
+        return not self._breaker(project_id).is_open
+
+    def get_quota(self, project_id: str) -> Dict[str, int]:
+        """Project quota read from Redis through the node's breaker, bypassing the in-process cache"""
+        return self._breaker(project_id).call(self._quota, project_id, True)
+
+    def _quota(self, project_id: str, fresh: bool = False) -> Dict[str, int]:
+        """
+        Project quota, falling back to the defaults for unset fields. Cached
+        for QUOTA_CACHE_TTL seconds, so overrides set on another instance
+        apply within that time.
+        """
+        now = time.monotonic()
+        if not fresh:
+            with self._quota_lock:
+                cached = self._quota_cache.get(project_id)
+            if cached is not None and now - cached[0] < QUOTA_CACHE_TTL:
+                return dict(cached[1])
+        overrides = self._redis(project_id).hgetall(f"rag_quota:{project_id}")
+        overrides = {k.decode() if isinstance(k, bytes) else k: int(v) for k, v in overrides.items()}
+        quota = {
+            "max_vectors": overrides.get("max_vectors", DEFAULT_MAX_VECTORS),
+            "max_qps": overrides.get("max_qps", DEFAULT_MAX_QPS)
+        }
+        with self._quota_lock:
+            self._quota_cache.pop(project_id, None)
+            self._quota_cache[project_id] = (now, quota)
+            while len(self._quota_cache) > QUOTA_CACHE_SIZE:
+                del self._quota_cache[next(iter(self._quota_cache))]
+        return dict(quota)
+
+    def set_quota(self, project_id: str, max_vectors: Optional[int] = None, max_qps: Optional[int] = None):
+        """Override a project's quotas through the node's breaker"""
+        mapping = {}
+        if max_vectors is not None:
+            mapping["max_vectors"] = max_vectors
+        if max_qps is not None:
+            mapping["max_qps"] = max_qps
+        if mapping:
+            self._breaker(project_id).call(
+                self._redis(project_id).hset, f"rag_quota:{project_id}", mapping=mapping
+            )
+            with self._quota_lock:
+                self._quota_cache.pop(project_id, None)
+
+    def _check_query_rate(self, project_id: str):
+        """Fixed one-second window query counter; no Redis call while the project is unlimited"""
+        max_qps = self._quota(project_id)["max_qps"]
+        if not max_qps:
+            return
+        key = f"rag_qps:{project_id}:{int(time.time())}"
+        pipe = self._redis(project_id).pipeline()
+        pipe.incr(key)
+        pipe.expire(key, 2)
+        count, _ = pipe.execute()
+        if count > max_qps:
+            raise QuotaExceededError(f"Project {project_id} exceeded {max_qps} queries per second")
         
     def create_index(self, project_id: str):
         """Create a vector index for the project if it doesn't exist"""
         index_name = f"rag:{project_id}"
         prefix = f"{index_name}:"
+        redis = self._redis(project_id)
         
         try:
-            self.redis.ft(index_name).info()
+            redis.ft(index_name).info()
             logger.info(f"Index {index_name} already exists")
             return
         except Exception:
@@ -56,20 +190,21 @@ class DocumentVectorIndexer:
         
         # Create index
         definition = IndexDefinition(prefix=[prefix], index_type=IndexType.HASH)
-        self.redis.ft(index_name).create_index(fields=schema, definition=definition)
+        redis.ft(index_name).create_index(fields=schema, definition=definition)
         logger.info(f"Created index {index_name}")
     
     def add_document(self, project_id: str, text: str, doc_id: Optional[str] = None) -> str:
         """Add a document to the vector store"""
+        redis = self._redis(project_id)
         if not doc_id:
-            doc_id = f"doc:{len(self.redis.keys(f'rag:{project_id}:*')) + 1}"
+            doc_id = f"doc:{len(redis.keys(f'rag:{project_id}:*')) + 1}"
             
         # Generate embedding
         embedding = self.vectorizer.embed(text)
         
         # Store in Redis
         key = f"rag:{project_id}:{doc_id}"
-        self.redis.hset(
+        redis.hset(
             key,
             mapping={
                 "id": doc_id,
@@ -79,13 +214,178 @@ class DocumentVectorIndexer:
         )
         return key
     
+    def _chunk_key(self, project_id: str, chunk_hash: str) -> str:
+        """Content-addressed key for a chunk, shared by every document containing it"""
+        return f"rag:{project_id}:chunk:{chunk_hash}"
+
+    def _manifest_key(self, project_id: str, document_id: str) -> str:
+        """Set of chunk hashes belonging to a document (kept outside the index prefix)"""
+        return f"rag_manifest:{project_id}:{document_id}"
+
+    @profiled("ingest")
+    def ingest_chunks(
+        self,
+        project_id: str,
+        chunks: List[str],
+        document_id: Optional[str] = None
+    ) -> Dict[str, int]:
+        """Ingest through the project node's circuit breaker; see _ingest_chunks"""
+        return self._breaker(project_id).call(self._ingest_chunks, project_id, chunks, document_id)
+
+    def _ingest_chunks(
+        self,
+        project_id: str,
+        chunks: List[str],
+        document_id: Optional[str] = None
+    ) -> Dict[str, int]:
+        """
+        Index text chunks, embedding only content that is not stored yet.
+
+        Chunks are keyed by their content hash, so identical chunks are stored
+        once per project and reference-counted. When document_id is given, a
+        manifest of the document's chunk hashes is kept and chunks that are no
+        longer part of the document are released on re-ingestion.
+
+        Ad-hoc text (no document_id) pins its chunks instead, so they survive
+        any document that shares them being re-ingested or deleted.
+
+        Returns counts of total, added and skipped chunks, chunks removed from
+        the document, and chunks deleted because no document uses them, plus
+        whether the document had been ingested before (reingested). Raises
+        QuotaExceededError if the new chunks would exceed the project's
+        stored-vector quota.
+        """
+        self.create_index(project_id)
+        redis = self._redis(project_id)
+
+        # Deduplicate within the upload while preserving order
+        hashed: Dict[str, str] = {}
+        for chunk in chunks:
+            if chunk and chunk.strip():
+                hashed.setdefault(content_hash(chunk), chunk)
+
+        previous: set = set()
+        if document_id:
+            manifest_key = self._manifest_key(project_id, document_id)
+            previous = {h.decode() if isinstance(h, bytes) else h
+                        for h in redis.smembers(manifest_key)}
+
+        incoming = [h for h in hashed if h not in previous]
+        removed = previous - set(hashed)
+
+        max_vectors = self._quota(project_id)["max_vectors"]
+        if max_vectors and incoming:
+            pipe = redis.pipeline()
+            for h in incoming:
+                pipe.hexists(self._chunk_key(project_id, h), "embedding")
+            missing = sum(1 for found in pipe.execute() if not found)
+            stored = int(redis.ft(f"rag:{project_id}").info().get("num_docs", 0))
+            if missing and stored + missing > max_vectors:
+                raise QuotaExceededError(
+                    f"Project {project_id} would store {stored + missing} vectors "
+                    f"(quota {max_vectors})"
+                )
+
+        # Take a reference on each incoming chunk atomically. Documents count
+        # references; ad-hoc text pins the chunk so no document release deletes it
+        pipe = redis.pipeline()
+        for h in incoming:
+            key = self._chunk_key(project_id, h)
+            if document_id:
+                pipe.hincrby(key, "refs", 1)
+            else:
+                pipe.hsetnx(key, "pinned", 1)
+            pipe.hexists(key, "embedding")
+        results = pipe.execute() if incoming else []
+        taken, embedded = results[0::2], results[1::2]
+        # Embed every referenced chunk that has no embedding yet, whoever created
+        # it, so a chunk left half-written by a failed upload is repaired here
+        new_hashes = [h for h, found in zip(incoming, embedded) if not found]
+        if document_id:
+            referenced = incoming
+        else:
+            referenced = [h for h, result in zip(incoming, taken) if result == 1]
+
+        try:
+            if new_hashes:
+                embeddings = self.vectorizer.embed_many([hashed[h] for h in new_hashes])
+            else:
+                embeddings = []
+
+            pipe = redis.pipeline()
+            for h, embedding in zip(new_hashes, embeddings):
+                pipe.hset(
+                    self._chunk_key(project_id, h),
+                    mapping={
+                        "id": h,
+                        "text": hashed[h],
+                        "content_hash": h,
+                        "embedding": np.array(embedding).astype(np.float32).tobytes()
+                    }
+                )
+            if document_id:
+                manifest_key = self._manifest_key(project_id, document_id)
+                if hashed:
+                    pipe.sadd(manifest_key, *hashed.keys())
+                if removed:
+                    pipe.srem(manifest_key, *removed)
+            pipe.execute()
+        except BaseException:
+            # Give back the references taken above so no chunk is left without an embedding
+            self._release_chunks(project_id, referenced, pinned=not document_id)
+            raise
+
+        deleted = self._release_chunks(project_id, removed)
+
+        stats = {
+            "total": len(hashed),
+            "added": len(new_hashes),
+            "skipped": len(hashed) - len(new_hashes),
+            "removed": len(removed),
+            "deleted": deleted,
+            "reingested": bool(previous)
+        }
+        logger.info(f"Ingested chunks for rag:{project_id} (document={document_id}): {stats}")
+        return stats
+
+    def _release_chunks(self, project_id: str, chunk_hashes, pinned: bool = False) -> int:
+        """Drop a document reference (or the ad-hoc pin) from each chunk, deleting unreferenced ones"""
+        redis = self._redis(project_id)
+        field = "pinned" if pinned else "refs"
+        pipe = redis.pipeline()
+        for h in chunk_hashes:
+            pipe.eval(RELEASE_CHUNK_SCRIPT, 1, self._chunk_key(project_id, h), field)
+        return sum(pipe.execute()) if chunk_hashes else 0
+
+    def ingest(self, project_id: str, text: str, document_id: Optional[str] = None) -> Dict[str, int]:
+        """Chunk raw text and index it with content-hash deduplication"""
+        return self.ingest_chunks(project_id, chunk_text(text), document_id)
+
+    def delete_document(self, project_id: str, document_id: str) -> int:
+        """Remove a document's manifest and release all of its chunks"""
+        redis = self._redis(project_id)
+        manifest_key = self._manifest_key(project_id, document_id)
+        hashes = {h.decode() if isinstance(h, bytes) else h
+                  for h in redis.smembers(manifest_key)}
+        redis.delete(manifest_key)
+        return self._release_chunks(project_id, hashes)
+
     def search_similar_chunks(self, query: str, project_id: str, top_k: int = 3) -> List[str]:
         """Search for similar text chunks using semantic search"""
         index_name = f"rag:{project_id}"
+        redis = self._redis(project_id)
+        breaker = self._breaker(project_id)
         
         try:
-            # Check if index exists
-            self.redis.ft(index_name).info()
+            # Check if index exists and the project is within its query rate
+            breaker.call(redis.ft(index_name).info)
+            breaker.call(self._check_query_rate, project_id)
+        except CircuitOpenError:
+            logger.warning(f"Skipping search of {index_name}: Redis circuit open")
+            return []
+        except QuotaExceededError as e:
+            logger.warning(f"Skipping search of {index_name}: {e}")
+            return []
         except Exception as e:
             logger.warning(f"Index {index_name} does not exist: {e}")
             return []
@@ -99,7 +399,8 @@ class DocumentVectorIndexer:
             query = "*=>[KNN {} @embedding $vector AS score]".format(top_k)
             
             # Execute query
-            results = self.redis.ft(index_name).search(
+            results = breaker.call(
+                redis.ft(index_name).search,
                 query,
                 query_params={"vector": query_vector}
             )
@@ -113,8 +414,8 @@ class DocumentVectorIndexer:
     def check_index_health(self, project_id: str) -> Dict:
         """Check if the index exists and has documents"""
         try:
-            index = self.redis.ft(f"rag:{project_id}")
-            info = index.info()
+            index = self._redis(project_id).ft(f"rag:{project_id}")
+            info = self._breaker(project_id).call(index.info)
             return {
                 "exists": True,
                 "num_docs": int(info.get('num_docs', 0)),
@@ -126,5 +427,35 @@ class DocumentVectorIndexer:
                 "error": str(e)
             }
 
+    def index_stats(self) -> Dict[str, Any]:
+        """Index and memory statistics aggregated across all shards"""
+        shards = []
+        total_docs = 0
+        for name, redis in self.ring.nodes.items():
+            try:
+                indexes = [i.decode() if isinstance(i, bytes) else i
+                           for i in self.breakers[name].call(redis.execute_command, "FT._LIST")]
+                projects = {}
+                for index_name in indexes:
+                    if not index_name.startswith("rag:"):
+                        continue
+                    info = redis.ft(index_name).info()
+                    projects[index_name[len("rag:"):]] = {
+                        "num_docs": int(info.get("num_docs", 0)),
+                        "vector_index_sz_mb": float(info.get("vector_index_sz_mb", 0) or 0)
+                    }
+                shard_docs = sum(p["num_docs"] for p in projects.values())
+                total_docs += shard_docs
+                shards.append({
+                    "node": name,
+                    "num_projects": len(projects),
+                    "num_docs": shard_docs,
+                    "used_memory": redis.info("memory").get("used_memory"),
+                    "projects": projects
+                })
+            except Exception as e:
+                shards.append({"node": name, "error": str(e)})
+        return {"num_shards": len(shards), "total_docs": total_docs, "shards": shards}
+
 # Global instance
 vector_indexer = DocumentVectorIndexer()
@@ -2,14 +2,23 @@ from fastapi import WebSocket, WebSocketDisconnect
 from redisvl.extensions.session_manager import SemanticSessionManager
 from app.agent_system import process_message, create_conversation_thread
 from app.shared_resources import redis_client
+from app.resilience import redis_breaker
+from app.session_state import parse_conversation_id
+from app.wire_protocol import negotiate_encoding, send_frame, receive_frame
 
-import json
+import os
 from datetime import datetime
 import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
+# History messages sent per page; older pages are loaded on request
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 10))
+MAX_HISTORY_PAGE_SIZE = 50
+# Furthest back a client can page; bounds the get_recent fetch
+MAX_HISTORY_OFFSET = int(os.getenv("MAX_HISTORY_OFFSET", 500))
+
 
 class ChatManager:
     def __init__(self):
@@ -23,9 +32,10 @@ class ChatManager:
     async def connect(self, websocket: WebSocket, thread_id: str = None):
         logger.info("Accepting WebSocket connection")
         await websocket.accept()
+        encoding = negotiate_encoding(websocket)
         if not thread_id:
             thread_id = create_conversation_thread()
-        logger.info(f"Thread {thread_id}: Connection established")
+        logger.info(f"Thread {thread_id}: Connection established ({encoding} frames)")
         self.active_connections[thread_id] = websocket
         return thread_id
         
@@ -33,37 +43,66 @@ class ChatManager:
         if thread_id in self.active_connections:
             del self.active_connections[thread_id]
 
-    async def send_thinking_step(self, websocket: WebSocket, step: str):
+    async def send_thinking_step(self, websocket: WebSocket, step: str, request_id: str = None):
         """Send a thinking step to the client"""
         message = {
             "type": "thinking_step",
-            "content": step
+            "content": step,
+            "request_id": request_id
         }
-        await websocket.send_json(message)
+        await send_frame(websocket, message)
         logger.info(f"Sent thinking step: {step}")
 
-    async def send_response(self, websocket: WebSocket, content: str, thinking_steps: list[str]):
-        """Send the final response to the client"""
+    async def send_response(self, websocket: WebSocket, content: str, request_id: str = None):
+        """Send the final response; thinking steps were already streamed as deltas"""
         message = {
             "type": "response",
             "content": content,
-            "thinking_steps": thinking_steps
+            "request_id": request_id
         }
-        await websocket.send_json(message)
+        await send_frame(websocket, message)
         logger.info(f"Sent response: {content[:50]}...")
 
-    async def get_chat_history(self, thread_id: str):
+    async def send_cancelled(self, websocket: WebSocket, request_id: str = None):
+        """
+        Tell the client a turn was cancelled. Clients that tag messages with a
+        request_id get a cancelled frame; untagged turns are closed with an
+        error frame, which older clients already settle their pending message on.
+        """
+        if request_id is not None:
+            message = {"type": "cancelled", "request_id": request_id}
+        else:
+            message = {"type": "error", "content": "Cancelled", "cancelled": True}
+        await send_frame(websocket, message)
+
+    async def get_chat_history(self, thread_id: str, offset: int = 0, limit: int = HISTORY_PAGE_SIZE):
+        """Return one page of history, `offset` messages back from the most recent"""
         try:
             # Get recent messages for the thread
-            messages = self.session_manager.get_recent(top_k=10)
-            return messages
+            messages = redis_breaker.call(self.session_manager.get_recent, top_k=offset + limit)
+            return messages[:max(len(messages) - offset, 0)][-limit:]
         except Exception as e:
             logger.error(f"Error getting chat history: {e}")
             return []
 
+    async def send_history_page(self, websocket: WebSocket, thread_id: str, offset: int = 0,
+                                limit: int = HISTORY_PAGE_SIZE):
+        """Send a page of history; clients ask for older pages with load_history"""
+        limit = max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
+        offset = max(0, min(offset, MAX_HISTORY_OFFSET))
+        history = await self.get_chat_history(thread_id, offset, limit)
+        logger.info(f"Thread {thread_id}: Retrieved history count = {len(history)} (offset {offset})")
+        if history or offset:
+            await send_frame(websocket, {
+                "type": "history",
+                "messages": history,
+                "offset": offset,
+                "has_more": len(history) == limit
+            })
+
     async def store_message(self, thread_id: str, role: str, content: str):
         try:
-            self.session_manager.add_message({
+            redis_breaker.call(self.session_manager.add_message, {
                 "role": role,
                 "content": content,
                 "thread_id": thread_id,
@@ -74,26 +113,117 @@ class ChatManager:
 
 chat_manager = ChatManager()
 
+async def run_turn(websocket: WebSocket, thread_id: str, content: str, quote: str, profile: bool = False,
+                   conversation_id: str = None, request_id: str = None):
+    """
+    Run a single chat turn; cancelling the task aborts the LLM call. Every
+    frame the turn sends echoes the client's request_id.
+    """
+    try:
+        # Store user message
+        await chat_manager.store_message(thread_id, "user", content)
+        logger.info(f"Thread {thread_id}: Stored user message: {content}")
+        
+        # Initial thinking steps - will be updated by agent
+        thinking_steps = [
+            "Processing your message...",
+            "Searching for relevant information...",
+            "Generating response..."
+        ]
+        
+        # Show initial thinking steps
+        sent_steps = set(thinking_steps)
+        for step in thinking_steps:
+            await chat_manager.send_thinking_step(websocket, step, request_id)
+            logger.info(f"Thread {thread_id}: Sent thinking step: {step}")
+            await asyncio.sleep(0.3)  # Short delay for UX
+        
+        # Process message through LangGraph agent
+        response, updated_thinking_steps = await process_message(thread_id, content, quote, profile, conversation_id)
+        
+        # Stream only the agent's thinking steps the client has not seen yet
+        for step in updated_thinking_steps or []:
+            if step not in sent_steps:
+                sent_steps.add(step)
+                await chat_manager.send_thinking_step(websocket, step, request_id)
+        
+        # Store assistant response
+        await chat_manager.store_message(thread_id, "assistant", response)
+        logger.info(f"Thread {thread_id}: Stored assistant response")
+        
+        # Send final response
+        await chat_manager.send_response(websocket, response, request_id)
+        logger.info(f"Thread {thread_id}: Sent final response")
+        
+    except asyncio.CancelledError:
+        logger.info(f"Thread {thread_id}: Turn cancelled")
+        raise
+    except WebSocketDisconnect:
+        logger.info(f"Thread {thread_id}: Client disconnected during turn")
+    except Exception as e:
+        error_msg = f"Error processing message: {str(e)}"
+        logger.error(f"Thread {thread_id}: {error_msg}")
+        try:
+            await send_frame(websocket, {
+                "type": "error",
+                "content": error_msg,
+                "request_id": request_id
+            })
+        except Exception:
+            logger.error(f"Thread {thread_id}: Could not send error message to client")
+
+async def cancel_turn(turn: asyncio.Task):
+    """Cancel a running turn and wait for it to unwind"""
+    if turn and not turn.done():
+        turn.cancel()
+        try:
+            await turn
+        except asyncio.CancelledError:
+            pass
+        return True
+    return False
+
 async def chat_endpoint(websocket: WebSocket, thread_id: str = None):
     thread_id = await chat_manager.connect(websocket, thread_id)
     logger.info(f"WebSocket opened for thread {thread_id}")
+    # Supabase conversation the client wants messages persisted to, if any
+    conversation_id = parse_conversation_id(websocket.query_params.get("conversation_id"))
+    # The turn currently generating and its request_id; the receive loop keeps listening while it runs
+    turn: asyncio.Task = None
+    turn_request_id: str = None
     
     try:
-        # Send chat history if thread exists
-        history = await chat_manager.get_chat_history(thread_id)
-        logger.info(f"Thread {thread_id}: Retrieved history count = {len(history)}")
-        if history:
-            await websocket.send_json({
-                "type": "history",
-                "messages": history
-            })
+        # Send the latest page of chat history unless the client loads it lazily
+        if websocket.query_params.get("history") != "lazy":
+            await chat_manager.send_history_page(websocket, thread_id)
         
         while True:
-            message = await websocket.receive_text()
-            data = json.loads(message)
+            data = await receive_frame(websocket)
+            
+            # Older history pages on request
+            if data.get("type") == "load_history":
+                try:
+                    offset = int(data.get("offset", 0))
+                    limit = int(data.get("limit", HISTORY_PAGE_SIZE))
+                except (TypeError, ValueError):
+                    await send_frame(websocket, {
+                        "type": "error",
+                        "content": "load_history offset and limit must be integers",
+                        "request_id": data.get("request_id")
+                    })
+                    continue
+                await chat_manager.send_history_page(websocket, thread_id, offset, limit)
+                continue
+            
+            # Explicit cancel frame from the client
+            if data.get("type") == "cancel":
+                if await cancel_turn(turn):
+                    await chat_manager.send_cancelled(websocket, turn_request_id)
+                    logger.info(f"Thread {thread_id}: Cancelled turn at client request")
+                continue
+            
             logger.info(f"Thread {thread_id}: Received message: {data.get('content','')}")
             content = data.get("content", "").strip()
-            file_url = data.get("fileUrl", "")
             quote = data.get("quote", "")
             
             # Debug log the entire message data
@@ -106,47 +236,16 @@ async def chat_endpoint(websocket: WebSocket, thread_id: str = None):
             if quote:
                 logger.info(f"Thread {thread_id}: Received quote: {quote[:50]}...")
             
-            # Store user message
-            await chat_manager.store_message(thread_id, "user", content)
-            logger.info(f"Thread {thread_id}: Stored user message: {content}")
-            
-            # Initial thinking steps - will be updated by agent
-            thinking_steps = [
-                "Processing your message...",
-                "Searching for relevant information...",
-                "Generating response..."
-            ]
-            
-            # Show initial thinking steps
-            for step in thinking_steps:
-                await chat_manager.send_thinking_step(websocket, step)
-                logger.info(f"Thread {thread_id}: Sent thinking step: {step}")
-                await asyncio.sleep(0.3)  # Short delay for UX
+            # A new message supersedes any generation still in progress
+            if await cancel_turn(turn):
+                await chat_manager.send_cancelled(websocket, turn_request_id)
+                logger.info(f"Thread {thread_id}: Cancelled superseded turn")
             
-            try:
-                # Process message through LangGraph agent
-                response, updated_thinking_steps = await process_message(thread_id, content, quote)
-                
-                # Update thinking steps if provided
-                if updated_thinking_steps and len(updated_thinking_steps) > 0:
-                    thinking_steps = updated_thinking_steps
-                    logger.info(f"Thread {thread_id}: Updated thinking steps from agent")
-                
-                # Store assistant response
-                await chat_manager.store_message(thread_id, "assistant", response)
-                logger.info(f"Thread {thread_id}: Stored assistant response")
-                
-                # Send final response
-                await chat_manager.send_response(websocket, response, thinking_steps)
-                
-            except Exception as e:
-                error_msg = f"Error processing message: {str(e)}"
-                logger.error(f"Thread {thread_id}: {error_msg}")
-                await websocket.send_json({
-                    "type": "error",
-                    "content": error_msg
-                })
-            logger.info(f"Thread {thread_id}: Sent final response")
+            turn_request_id = data.get("request_id")
+            turn = asyncio.create_task(run_turn(
+                websocket, thread_id, content, quote, bool(data.get("profile")), conversation_id,
+                turn_request_id
+            ))
             
     except WebSocketDisconnect:
         chat_manager.disconnect(thread_id)
@@ -154,9 +253,12 @@ async def chat_endpoint(websocket: WebSocket, thread_id: str = None):
     except Exception as e:
         logger.error(f"Thread {thread_id}: Error in chat endpoint: {str(e)}")
         try:
-            await websocket.send_json({
+            await send_frame(websocket, {
                 "type": "error",
                 "content": str(e)
             })
         except:
-            logger.error(f"Thread {thread_id}: Could not send error message to client") 
\ No newline at end of file
+            logger.error(f"Thread {thread_id}: Could not send error message to client")
+    finally:
+        # Stop paying for a generation nobody will receive
+        await cancel_turn(turn)
@@ -0,0 +1,82 @@
+"""
+WebSocket frame encoding.
+
+Clients choose a frame encoding at connect time with the `encoding` query
+parameter (`json`, `orjson` or `msgpack`). JSON frames are sent as text; the
+binary encodings are sent as bytes frames. Encodings whose library is not
+installed fall back to JSON.
+"""
+from fastapi import WebSocket, WebSocketDisconnect
+
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+JSON = "json"
+ORJSON = "orjson"
+MSGPACK = "msgpack"
+
+
+def available_encodings() -> list[str]:
+    encodings = [JSON]
+    if orjson is not None:
+        encodings.append(ORJSON)
+    if msgpack is not None:
+        encodings.append(MSGPACK)
+    return encodings
+
+
+def negotiate_encoding(websocket: WebSocket) -> str:
+    """Pick the frame encoding requested by the client and remember it on the socket"""
+    requested = websocket.query_params.get("encoding", JSON).lower()
+    encoding = requested if requested in available_encodings() else JSON
+    if encoding != requested:
+        logger.warning(f"Encoding {requested} unavailable, falling back to {JSON}")
+    websocket.state.encoding = encoding
+    return encoding
+
+
+def encode(message: dict, encoding: str) -> bytes:
+    if encoding == ORJSON:
+        return orjson.dumps(message)
+    if encoding == MSGPACK:
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message).encode("utf-8")
+
+
+def decode(data: bytes, encoding: str) -> dict:
+    if encoding == ORJSON:
+        return orjson.loads(data)
+    if encoding == MSGPACK:
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+async def send_frame(websocket: WebSocket, message: dict):
+    """Send a message using the socket's negotiated encoding"""
+    encoding = getattr(websocket.state, "encoding", JSON)
+    if encoding == JSON:
+        await websocket.send_json(message)
+    else:
+        await websocket.send_bytes(encode(message, encoding))
+
+
+async def receive_frame(websocket: WebSocket) -> dict:
+    """Receive a text (JSON) or bytes (negotiated encoding) frame"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return decode(message["bytes"], getattr(websocket.state, "encoding", JSON))
+    return json.loads(message["text"])
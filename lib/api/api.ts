@@ -1,11 +1,15 @@
 // WebSocket client for chat
+type PendingMessage = {
+  resolve: (value: any) => void;
+  reject: (error: Error) => void;
+  thinking_steps: string[];
+};
+
 class WebSocketChatClient {
   private ws: WebSocket | null = null;
-  private messageQueue: Array<{
-    resolve: (value: any) => void;
-    reject: (error: Error) => void;
-  }> = [];
-  private thinking_steps: string[] = [];
+  // Messages awaiting a reply, keyed by the request_id the server echoes on every frame
+  private pending = new Map<string, PendingMessage>();
+  private nextRequestId = 0;
   private isConnected = false;
   private reconnectAttempts = 0;
   private maxReconnectAttempts = 3;
@@ -14,6 +18,11 @@ class WebSocketChatClient {
     this.connect();
   }
 
+  private rejectAll(error: Error) {
+    this.pending.forEach((message) => message.reject(error));
+    this.pending.clear();
+  }
+
   private connect() {
     if (this.ws?.readyState === WebSocket.OPEN) return;
 
@@ -26,6 +35,7 @@ class WebSocketChatClient {
 
     this.ws.onclose = () => {
       this.isConnected = false;
+      this.rejectAll(new Error('WebSocket closed'));
       if (this.reconnectAttempts < this.maxReconnectAttempts) {
         this.reconnectAttempts++;
         setTimeout(() => this.connect(), 1000 * this.reconnectAttempts);
@@ -34,31 +44,36 @@ class WebSocketChatClient {
 
     this.ws.onmessage = (event) => {
       const data = JSON.parse(event.data);
+      const currentMessage = data.request_id ? this.pending.get(data.request_id) : undefined;
       if (data.type === 'thinking_step') {
-        this.thinking_steps.push(data.content);
+        currentMessage?.thinking_steps.push(data.content);
       } else if (data.type === 'response') {
-        const currentMessage = this.messageQueue.shift();
         if (currentMessage) {
+          this.pending.delete(data.request_id);
           currentMessage.resolve({
             content: data.content,
-            thinking_steps: this.thinking_steps
+            thinking_steps: currentMessage.thinking_steps
           });
-          this.thinking_steps = [];
+        }
+      } else if (data.type === 'cancelled') {
+        if (currentMessage) {
+          this.pending.delete(data.request_id);
+          currentMessage.reject(new Error('Message cancelled'));
         }
       } else if (data.type === 'error') {
-        const currentMessage = this.messageQueue.shift();
         if (currentMessage) {
+          this.pending.delete(data.request_id);
           currentMessage.reject(new Error(data.content));
+        } else if (!data.request_id) {
+          // Connection-level error: no turn will complete
+          this.rejectAll(new Error(data.content));
         }
       }
     };
 
     this.ws.onerror = (error) => {
       console.error('WebSocket error:', error);
-      const currentMessage = this.messageQueue.shift();
-      if (currentMessage) {
-        currentMessage.reject(new Error('WebSocket error'));
-      }
+      this.rejectAll(new Error('WebSocket error'));
     };
   }
 
@@ -72,11 +87,12 @@ class WebSocketChatClient {
       console.log('WebSocketChatClient: Sending message with quote:', quote);
     }
     
-    const payload = { content, fileUrl, quote };
+    const request_id = `${Date.now()}-${++this.nextRequestId}`;
+    const payload = { content, fileUrl, quote, request_id };
     console.log('WebSocketChatClient: Sending payload:', payload);
 
     return new Promise((resolve, reject) => {
-      this.messageQueue.push({ resolve, reject });
+      this.pending.set(request_id, { resolve, reject, thinking_steps: [] });
       this.ws?.send(JSON.stringify(payload));
     });
   }